@@ -0,0 +1,26 @@
+import hashlib
+import os
+import shelve
+from functools import lru_cache
+
+import requests
+
+WIKIPEDIA_API_URL = "https://en.wikipedia.org/w/api.php"
+CACHE_DIR = ".cache"
+
+# One session for all requests, so the TCP/TLS connection is reused
+_SESSION = requests.Session()
+
+
+@lru_cache(maxsize=32)
+def wiki_extract(title):
+    """Return the plain text extract of a Wikipedia page, cached in memory and on disk."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with shelve.open(os.path.join(CACHE_DIR, "wikipedia")) as cache:
+        key = hashlib.sha1(title.encode()).hexdigest()
+        if key not in cache:
+            response = _SESSION.get(WIKIPEDIA_API_URL, params={
+                "action": "query", "format": "json", "titles": title, "prop": "extracts", "explaintext": ""})
+            response.raise_for_status()
+            cache[key] = next(iter(response.json()['query']['pages'].values()))['extract']
+        return cache[key]
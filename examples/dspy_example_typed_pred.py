@@ -1,5 +1,10 @@
 import dspy
-from pydantic import BaseModel, Field
+import json
+import logging
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pydantic import BaseModel, Field, ValidationError
 from typing import List, Dict, Any, Optional
 from graphmemory import GraphMemory, Node, Edge
 
@@ -8,6 +13,11 @@ lm = dspy.OpenAI(
 )
 dspy.settings.configure(lm=lm)
 
+# Per node and edge messages are debug only; pass -v to see them
+logging.basicConfig(format="%(message)s")
+log = logging.getLogger("graphmem")
+log.setLevel(logging.DEBUG if "-v" in sys.argv[1:] else logging.INFO)
+
 
 class NodeOutput(BaseModel):
     """
@@ -49,7 +59,7 @@ class EdgesSignature(dspy.Signature):
     input_nodes: List[Node] = dspy.InputField(
         description="The nodes in the graph to connect.")
     output_edges: List[EdgeOutput] = dspy.OutputField(
-        description="The edge list connecting the nodes in the graph.")
+        description="The edge list connecting the nodes in the graph. Only use ids of the provided input nodes.")
 
 
 unstructured_text = '''
@@ -73,46 +83,77 @@ Nevertheless, Six Companies turned the dam over to the federal government on Mar
 1, 1936, more than two years ahead of schedule.
 '''
 
-sentences = unstructured_text.split(".")
+# Split on sentence-ending punctuation followed by a capitalized word, but not after initials like "D."
+SENTENCE_SPLIT = re.compile(r'(?<!\b[A-Z]\.)(?<=[.!?])\s+(?=[A-Z])')
+sentences = [s.strip() for s in SENTENCE_SPLIT.split(unstructured_text) if s.strip()]
+# Extract from windows of a few sentences so each window's nodes are sent to the edges predictor once
+WINDOW_SIZE = 5
+windows = [' '.join(sentences[i:i + WINDOW_SIZE]) for i in range(0, len(sentences), WINDOW_SIZE)]
 nodes_predictor = dspy.TypedPredictor(NodesSignature)
 edges_predictor = dspy.TypedPredictor(EdgesSignature)
 
 nodes = []
 edges = []
+# Nodes already extracted, keyed by type and properties, so repeated entities are only added once
+seen_nodes = {}
 
-for sentence in sentences:
-    try:
-        new_nodes_dicts = nodes_predictor(input_text=sentence).output_nodes
-        new_nodes = [Node(properties=node_dict.properties, type=node_dict.type)
-                     for node_dict in new_nodes_dicts if node_dict.properties and node_dict.proper_noun]
-        for node in new_nodes:
-            nodes.append(node)
-            print(f"Added new node: {node.properties}")
-    except Exception as e:
-        pass
 
-for sentence in sentences:
+def extract_graph(window):
+    # Extract the nodes and then the edges between them for one window in a single pass
+    new_nodes_dicts = nodes_predictor(input_text=window).output_nodes
+    new_nodes = [Node(properties=node_dict.properties, type=node_dict.type)
+                 for node_dict in new_nodes_dicts if node_dict.properties and node_dict.proper_noun]
+    # A failed edge extraction or an invalid edge only drops edges, the window's nodes are kept
+    new_edges = []
     try:
         new_edges_dict = edges_predictor(
-            input_text=sentence, input_nodes=nodes).output_edges
-        new_edges = [Edge(source_id=edge.source_id, target_id=edge.target_id,
-                          relation=edge.relation) for edge in new_edges_dict]
+            input_text=window, input_nodes=new_nodes).output_edges
+    except Exception as e:
+        log.debug("Edge extraction failed: %s", e)
+        return new_nodes, new_edges
+    for edge in new_edges_dict:
+        try:
+            new_edges.append(Edge(source_id=edge.source_id, target_id=edge.target_id,
+                                  relation=edge.relation))
+        except ValidationError as e:
+            # ex: the model returned a name instead of a node id
+            log.debug("Skipped invalid edge: %s", e)
+    return new_nodes, new_edges
+
+
+# Maps the id of every extracted node to the id of the deduplicated node kept in the graph
+node_aliases = {}
+
+# The predictor calls are network-bound, so run the windows concurrently
+with ThreadPoolExecutor(max_workers=16) as pool:
+    futures = [pool.submit(extract_graph, window) for window in windows]
+    for future in as_completed(futures):
+        try:
+            new_nodes, new_edges = future.result()
+        except Exception as e:
+            continue
+        for node in new_nodes:
+            key = (node.type, json.dumps(node.properties, sort_keys=True))
+            kept_node = seen_nodes.setdefault(key, node)
+            node_aliases[node.id] = kept_node.id
+            if kept_node is node:
+                nodes.append(node)
+                log.debug("Added new node: %s", node.properties)
         for edge in new_edges:
-            if edge.source_id and edge.target_id and edge.relation:
+            if edge.source_id in node_aliases and edge.target_id in node_aliases and edge.relation:
+                edge.source_id = node_aliases[edge.source_id]
+                edge.target_id = node_aliases[edge.target_id]
                 edges.append(edge)
-                print(f"Added new edge: {edge.source_id} - {edge.relation} - {edge.target_id}")
-    except Exception as e:
-        pass
+                log.debug("Added new edge: %s - %s - %s", edge.source_id, edge.relation, edge.target_id)
 
 
 # Create an instance of GraphMemory
-graph_memory = GraphMemory(database="hoover.db")
+graph_memory = GraphMemory(database="hoover.db", config={"checkpoint_threshold": "256MB"})
 # Bulk insert nodes
 inserted_nodes = graph_memory.bulk_insert_nodes(nodes)
-print(f"Inserted {len(inserted_nodes)} nodes.")
 # Bulk insert edges
 graph_memory.bulk_insert_edges(edges)
-print(f"Inserted {len(edges)} edges.")
+log.info("Inserted %d nodes and %d edges from %d windows.", len(inserted_nodes), len(edges), len(windows))
 
 # Print the graph
 graph_memory.print_json()
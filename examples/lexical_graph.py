@@ -1,43 +1,72 @@
 from graphmemory import GraphMemory, Node, Edge
-from langchain.text_splitter import CharacterTextSplitter
+from _wiki import wiki_extract
+from langchain.text_splitter import RecursiveCharacterTextSplitter
 from sentence_transformers import SentenceTransformer
 from openai import OpenAI
-import requests
+import hashlib
+import numpy as np
+import os
+import shelve
+
+# Embeddings are cached on disk so repeat runs skip the model
+CACHE_DIR = ".cache"
+os.makedirs(CACHE_DIR, exist_ok=True)
+MODEL_NAME = "all-MiniLM-L6-v2"
+# Cached embeddings are stored as raw float32 bytes, 4 bytes per dimension
+EMBEDDING_CACHE_PREFIX = MODEL_NAME + ":normalized:float32:"
+
+
+def cache_key(value):
+    return hashlib.sha1(value.encode()).hexdigest()
+
 
 # Get wikipedia page on Hoover Dam
-r = requests.get(
-    'https://en.wikipedia.org/w/api.php?action=query&format=json&titles=Hoover%20Dam&prop=extracts&explaintext')
-text = r.json()['query']['pages']['14308']['extract']
+text = wiki_extract("Hoover Dam")
 
 print(text)
 
-text_splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=0)
-texts = text_splitter.split_text(text)
+model = SentenceTransformer(MODEL_NAME)
 
-model = SentenceTransformer("all-MiniLM-L6-v2")
+# Size chunks in model tokens so they fit the model's 256 token window instead of being silently truncated
+text_splitter = RecursiveCharacterTextSplitter.from_huggingface_tokenizer(
+    model.tokenizer, chunk_size=200, chunk_overlap=20)
+texts = text_splitter.split_text(text)
 client = OpenAI()
 graph_memory = GraphMemory(
     database="hoover.db",
-    vector_length=model.get_sentence_embedding_dimension()
+    vector_length=model.get_sentence_embedding_dimension(),
+    # Defer WAL checkpoints until the ingest is done
+    config={"checkpoint_threshold": "256MB"},
+    # Embeddings are normalized at encode time, so a plain dot product ranks like cosine similarity
+    metric="ip"
 )
 
-previous_node = None
+with shelve.open(os.path.join(CACHE_DIR, "embeddings")) as cache:
+    keys = [cache_key(EMBEDDING_CACHE_PREFIX + text) for text in texts]
+    missing = [text for text, key in zip(texts, keys) if key not in cache]
+    if missing:
+        # Encode all uncached chunks in one call so the model can batch them
+        encoded = model.encode(missing, batch_size=64, show_progress_bar=False, convert_to_numpy=True,
+                               normalize_embeddings=True).astype(np.float32, copy=False)
+        for text, embedding in zip(missing, encoded):
+            cache[cache_key(EMBEDDING_CACHE_PREFIX + text)] = embedding.tobytes()
+    embeddings = np.stack([np.frombuffer(cache[key], dtype=np.float32) for key in keys])
+
+nodes = []
+# float32 values round-trip exactly through Python floats into the FLOAT[n] vector column
+for text, embedding in zip(texts, embeddings.tolist()):
+    nodes.append(Node(type="text", properties={"content": text}, vector=embedding))
 
-for text in texts:
-    embedding = model.encode(text)
-    embedding = [float(e) for e in embedding]
-    node = Node(type="text", properties={"content": text}, vector=embedding)
-    graph_memory.insert_node(node)
-    if previous_node:
-        edge = Edge(source_id=previous_node.id, target_id=node.id, relation="followed_by")
-        graph_memory.insert_edge(edge)
-    previous_node = node
-    
+# Insert all chunks in one transaction, then link consecutive chunks
+graph_memory.bulk_insert_nodes(nodes, defer_index=True)
+edges = [Edge(source_id=previous_node.id, target_id=node.id, relation="followed_by")
+         for previous_node, node in zip(nodes, nodes[1:])]
+graph_memory.bulk_insert_edges(edges)
 
 query = "What was the issue with the naming controversy of the Hoover Dam?"
-query_embedding = model.encode(query)
-query_embedding = [float(e) for e in query_embedding]
-results = graph_memory.nearest_nodes(vector=query_embedding, limit=3)
+query_embedding = model.encode(query, normalize_embeddings=True).astype(np.float32).tolist()
+# Pre-filter candidates on the sign-bit quantized vectors, then rescore them in float32
+results = graph_memory.nearest_nodes(vector=query_embedding, limit=3, precision="binary", oversample=4)
 
 if results:
     response = client.chat.completions.create(
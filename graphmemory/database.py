@@ -3,37 +3,305 @@ import json
 import os
 import logging
 from contextlib import contextmanager
+from functools import lru_cache
 from graphmemory.models import Node, Edge, NearestNode
-from typing import List, Any
+from typing import Iterable, List, Any, Sequence, Union
 from typing import Dict as D
+import re
+import threading
 import uuid
 
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Logging is configured by the application, the library only emits records
 logger = logging.getLogger(__name__)
 
+# Sign-bit quantization of a FLOAT[] expression into a BIT string, used for Hamming pre-filtering
+BINARY_QUANTIZE_SQL = "CAST(array_to_string(list_transform({vector}, x -> CASE WHEN x > 0 THEN '1' ELSE '0' END), '') AS BIT)"
+
+# Distance expression for each supported metric, smaller is closer. "ip" expects unit-length vectors
+# and ranks by a plain dot product, avoiding the per-row norms computed for "cosine".
+DISTANCE_SQL = {
+    "l2": "array_distance({vector}, {query})",
+    "cosine": "1 - array_cosine_similarity({vector}, {query})",
+    "ip": "-array_inner_product({vector}, {query})",
+}
+# HNSW index metric matching each distance
+HNSW_METRICS = {"l2": "l2sq", "cosine": "cosine", "ip": "ip"}
+# VSS only answers ORDER BY ... LIMIT from a cosine or ip index when ordering by the plain similarity,
+# returning the most similar rows first. Without the index the same query returns the least similar,
+# so these are only used while the index exists. Each maps the similarity back to the distance.
+HNSW_SIMILARITY_SQL = {
+    "cosine": ("array_cosine_similarity({vector}, {query})", "1 - similarity"),
+    "ip": ("array_inner_product({vector}, {query})", "-similarity"),
+}
+
+# Fixed id-keyed statements, prepared once per connection and run with EXECUTE
+PREPARED_SQL = {
+    "get_node": "SELECT id, type, properties, vector FROM nodes WHERE id = $1;",
+    "get_node_meta": "SELECT id, type, properties, NULL AS vector FROM nodes WHERE id = $1;",
+    "get_nodes_vector": "SELECT vector FROM nodes WHERE id = $1;",
+}
+
+# Inserts a JSON array of edges, unpacked server-side so a whole batch is one statement and one parameter
+BULK_INSERT_EDGES_SQL = (
+    "INSERT INTO edges (id, source_id, target_id, relation, weight) "
+    "SELECT r.id, r.source_id, r.target_id, r.relation, r.weight "
+    "FROM (SELECT unnest(json_transform(CAST($1 AS JSON), '[{\"id\": \"UUID\", \"source_id\": \"UUID\", "
+    "\"target_id\": \"UUID\", \"relation\": \"VARCHAR\", \"weight\": \"FLOAT\"}]')) AS r);"
+)
+
+# Cypher tokens, matched one at a time by a single compiled pattern. Every alternative is a plain
+# character class or quoted run, so tokenizing never backtracks.
+CYPHER_TOKEN_RE = re.compile(r"""\s*(?:
+    (?P<string>'[^']*'|"[^"]*")
+    |(?P<number>\d+(?:\.\d+)?(?!\w))
+    |(?P<name>\w+)
+    |(?P<symbol>[-<>()\[\]{}:,.;])
+)""", re.VERBOSE)
+
+
+def _loads_many(documents):
+    # Decode a column of JSON documents with a single json.loads call instead of one call per row
+    return json.loads("[" + ",".join(doc if doc is not None else "null" for doc in documents) + "]")
+
+
+def _parse_cypher_value(kind, value):
+    # Only number tokens are converted, a quoted '02139' stays a string
+    if kind == "number":
+        return float(value) if "." in value else int(value)
+    if kind == "string":
+        return value[1:-1]
+    return value
+
+
+def _tokenize_cypher(cypher_query):
+    tokens = []
+    position = 0
+    end = len(cypher_query.rstrip())
+    while position < end:
+        match = CYPHER_TOKEN_RE.match(cypher_query, position)
+        if not match:
+            raise ValueError(f"Invalid Cypher query: unexpected character at {position}")
+        tokens.append((match.lastgroup, match.group(match.lastgroup)))
+        position = match.end()
+    return tokens
+
+
+class _CypherParser:
+    # Recursive-descent parser for MATCH (a:Label {key: value})-[r:TYPE]->(b) RETURN a, b.field.
+    # Property values are collected separately, so the parsed shape is the same for any values.
+    def __init__(self, cypher_query):
+        self.tokens = _tokenize_cypher(cypher_query)
+        self.position = 0
+        self.values = []
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def accept(self, text):
+        kind, value = self.peek()
+        if value is not None and (value.upper() == text if kind == "name" else value == text):
+            self.position += 1
+            return True
+        return False
+
+    def expect(self, text):
+        if not self.accept(text):
+            raise ValueError(f"Invalid Cypher query: expected {text!r}, got {self.peek()[1]!r}")
+
+    def name(self):
+        kind, value = self.peek()
+        if kind != "name":
+            raise ValueError(f"Invalid Cypher query: expected a name, got {value!r}")
+        self.position += 1
+        return value
+
+    def parse(self):
+        if not self.accept("MATCH"):
+            raise ValueError("Invalid Cypher query: missing MATCH or RETURN clause")
+        nodes = [self.node()]
+        relationships = []
+        while not self.accept("RETURN"):
+            if self.peek()[1] is None:
+                raise ValueError("Invalid Cypher query: missing MATCH or RETURN clause")
+            relationships.append(self.relationship(len(relationships) + 1))
+            nodes.append(self.node())
+        returns = [self.return_item()]
+        while self.accept(","):
+            returns.append(self.return_item())
+        self.accept(";")
+        if self.peek()[1] is not None:
+            raise ValueError(f"Invalid Cypher query: unexpected {self.peek()[1]!r}")
+        return (tuple(nodes), tuple(relationships), tuple(returns)), tuple(self.values)
+
+    def node(self):
+        self.expect("(")
+        alias = self.name()
+        label = self.name() if self.accept(":") else None
+        properties = self.properties()
+        self.expect(")")
+        return alias, label, properties
+
+    def relationship(self, number):
+        # Direction is accepted but not used, relationships are matched the same both ways
+        self.accept("<")
+        self.expect("-")
+        alias, label, properties = None, None, ()
+        if self.accept("["):
+            if self.peek()[0] == "name":
+                alias = self.name()
+            label = self.name() if self.accept(":") else None
+            properties = self.properties()
+            self.expect("]")
+        self.expect("-")
+        self.accept(">")
+        return alias or f"r{number}", label, properties
+
+    def properties(self):
+        # Each property maps its key to the index of its value in self.values
+        properties = []
+        if self.accept("{"):
+            while not self.accept("}"):
+                if properties:
+                    self.expect(",")
+                key = self.name()
+                self.expect(":")
+                kind, value = self.peek()
+                if kind not in ("string", "number", "name"):
+                    raise ValueError(f"Invalid Cypher query: expected a value, got {value!r}")
+                self.position += 1
+                properties.append((key, len(self.values)))
+                self.values.append(_parse_cypher_value(kind, value))
+        return tuple(properties)
+
+    def return_item(self):
+        alias = self.name()
+        return alias, self.name() if self.accept(".") else None
+
+
+@lru_cache(maxsize=1024)
+def _parse_cypher(cypher_query):
+    return _CypherParser(cypher_query).parse()
+
+
+def _cypher_to_sql(cypher_query):
+    # Property values are parsed out of the query and bound as parameters, so they never reach the SQL text
+    # and queries that only differ in their values share one cached template.
+    shape, values = _parse_cypher(cypher_query)
+    sql_query, param_sources = _cypher_template(shape)
+    # Each source is either a constant of the template or the index of a parsed value
+    params = [json.dumps(values[source]) if isinstance(source, int) else source for source in param_sources]
+    return sql_query, params
+
+
+@lru_cache(maxsize=256)
+def _cypher_template(shape):
+    # Translation only depends on the parsed shape of the query, so repeated shapes are served from the cache
+    nodes, relationships, return_content = shape
+    param_sources = []
+
+    def param(source):
+        param_sources.append(source)
+        return f"${len(param_sources)}"
+
+    # Start building the SQL query
+    sql_query = "SELECT "
+    sql_parts = []
+
+    # Determine what is being returned
+    for alias, field in return_content:
+        if field:
+            if field == "embedding":
+                sql_parts.append(f"{alias}.{field}")
+        else:
+            sql_parts.append("*")
+
+    if not sql_parts:
+        sql_parts.append("*")
+
+    from_clause = []
+    where_conditions = []
+
+    # Process nodes and relationships in sequence
+    for i, node in enumerate(nodes):
+        alias, label, properties = node
+        if i == 0:
+            from_clause.append(f"nodes AS {alias}")
+        else:
+            prev_node = nodes[i-1][0]
+            rel_alias = relationships[i-1][0]
+            from_clause.append(f"JOIN nodes AS {alias} ON {prev_node}.id = {rel_alias}.start_node_id AND {alias}.id = {rel_alias}.end_node_id")
+
+        if label:
+            where_conditions.append(f"{alias}.type = {param(label)}")
+        for prop, value_index in properties:
+            if prop == "embedding":
+                sql_parts.append(f"{alias}.embedding")
+            else:
+                where_conditions.append(f"json_extract({alias}.properties, {param(f'$.{prop}')}) = json({param(value_index)})")
+
+    for rel_alias, rel_label, rel_properties in relationships:
+        if rel_label:
+            where_conditions.append(f"{rel_alias}.type = {param(rel_label)}")
+        for prop, value_index in rel_properties:
+            where_conditions.append(f"json_extract({rel_alias}.properties, {param(f'$.{prop}')}) = json({param(value_index)})")
+
+    sql_query += ", ".join(sql_parts)
+    sql_query += " FROM " + " ".join(from_clause)
+
+    if where_conditions:
+        sql_query += " WHERE " + " AND ".join(where_conditions)
+
+    return sql_query + ";", tuple(param_sources)
+
+
+def _vector_json(vector):
+    # Array-likes (numpy arrays, array.array) are converted in C with tolist, and default=float
+    # covers numpy scalars inside plain lists. numpy itself is not required.
+    if hasattr(vector, "tolist"):
+        vector = vector.tolist()
+    return json.dumps(vector, default=float)
+
+
+def _node_from_row(row, properties):
+    # Rows of (id, type, properties, vector) come from our own tables, so pydantic validation is skipped.
+    # FLOAT[n] columns are fetched as tuples while Node.vector is a list.
+    return Node.model_construct(id=row[0], type=row[1], properties=properties,
+                                vector=list(row[3]) if row[3] is not None else None)
+
 
 class GraphMemory:
-    def __init__(self, database=None, vector_length=3):
+    def __init__(self, database=None, vector_length=3, config=None, metric="l2", m=16, ef_construction=128, ef_search=64):
+        if metric not in DISTANCE_SQL:
+            raise ValueError(f"Unsupported metric: {metric}")
         self.database = database
         self.vector_length = vector_length
-        self.conn = duckdb.connect(database=self.database)
+        self.metric = metric
+        # HNSW parameters, the defaults match DuckDB VSS
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self._transaction_depth = 0
+        self._transaction_thread = None
+        # Whether vss_idx exists with this instance's metric, nearest_nodes then searches it
+        self._vector_index = False
+        # Writes go through self.conn one thread at a time, reads use a cursor per thread (see _reader)
+        self._write_lock = threading.RLock()
+        self._local = threading.local()
+        self._build_nearest_sql()
+        # Extra DuckDB settings applied when opening the connection, ex: {"checkpoint_threshold": "256MB"}
+        self.conn = duckdb.connect(database=self.database, config=config or {})
         self._load_vss_extension()
         self._configure_database()
 
         if database and os.path.exists(database):
             self.load_database(database)
 
-        # Check if 'nodes' and 'edges' tables exist, and create them if they do not
-        nodes_exist = self.conn.execute(
-            "SELECT 1 FROM information_schema.tables WHERE table_name = 'nodes';").fetchone()
-        edges_exist = self.conn.execute(
-            "SELECT 1 FROM information_schema.tables WHERE table_name = 'edges';").fetchone()
-
-        if not nodes_exist or not edges_exist:
-            self._create_tables()
-            logger.info("Tables created or verified successfully.")
+        # Every statement in _create_tables is IF NOT EXISTS, so it is safe to run on each open
+        self._create_tables()
+        self._add_quantized_columns()
+        logger.info("Tables created or verified successfully.")
+        self._prepare_statements()
 
     def load_database(self, path):
         if not os.path.exists(path):
@@ -59,7 +327,9 @@ class GraphMemory:
 
     def set_vector_length(self, vector_length):
         self.vector_length = vector_length
-        logger.info(f"Vector length set to: {self.vector_length}")
+        self._build_nearest_sql()
+        self._refresh_vector_index()
+        logger.info("Vector length set to: %d", self.vector_length)
 
     def _create_tables(self):
         # Correctly format the SQL string to include vector_length
@@ -68,7 +338,8 @@ class GraphMemory:
             id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
             type TEXT,
             properties JSON,
-            vector FLOAT[{self.vector_length}]
+            vector FLOAT[{self.vector_length}],
+            vector_bin BIT
         );
         """)
         self.conn.execute(f"""
@@ -82,180 +353,388 @@ class GraphMemory:
             FOREIGN KEY (target_id) REFERENCES nodes(id)
         );
         """)
+        # Neighbor lookups filter edges by either endpoint
+        self.conn.execute("CREATE INDEX IF NOT EXISTS edges_source_idx ON edges(source_id);")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS edges_target_idx ON edges(target_id);")
+        # The vector index is opt-in through create_index(). One left by an earlier open is kept,
+        # and rebuilt if it was built with a different metric.
+        if self._has_vector_index():
+            self._create_index()
         logger.info("Tables 'nodes' and 'edges' created or already exist.")
         self.conn.commit()
 
+    def _add_quantized_columns(self):
+        # Databases created before quantization support lack the shadow column, add and backfill it
+        try:
+            self.conn.execute("ALTER TABLE nodes ADD COLUMN IF NOT EXISTS vector_bin BIT;")
+            self.conn.execute(
+                f"UPDATE nodes SET vector_bin = {BINARY_QUANTIZE_SQL.format(vector='vector')} "
+                "WHERE vector_bin IS NULL AND vector IS NOT NULL;")
+        except duckdb.Error as e:
+            logger.error(f"Error adding quantized columns: {e}")
+
+    def _prepare_statements(self, conn=None):
+        conn = conn or self.conn
+        for name, sql in PREPARED_SQL.items():
+            conn.execute(f"PREPARE {name} AS {sql}")
+
+    def _reader(self):
+        # Reads inside this thread's open transaction must see its uncommitted writes, so they stay on self.conn
+        if self._transaction_thread == threading.get_ident():
+            return self.conn
+        # Otherwise each thread reads through its own cursor on the same database, so reads run concurrently
+        # instead of sharing one connection. Prepared statements are per cursor.
+        cursor = getattr(self._local, "cursor", None)
+        if cursor is None:
+            cursor = self.conn.cursor()
+            self._prepare_statements(cursor)
+            self._local.cursor = cursor
+        return cursor
+
+    def _execute_prepared(self, name, *ids, conn=None):
+        # EXECUTE does not accept bound parameters, so ids are passed as canonical UUID literals.
+        # uuid.UUID rejects anything that is not a UUID, so no other text can reach the statement.
+        args = ", ".join(f"'{uuid.UUID(str(value))}'" for value in ids)
+        return (conn or self.conn).execute(f"EXECUTE {name}({args});")
+
+    def _insert_node_sql(self):
+        vector = f"CAST($4 AS FLOAT[{self.vector_length}])"
+        return (
+            "INSERT INTO nodes (id, type, properties, vector, vector_bin) "
+            f"VALUES ($1, $2, $3, {vector}, {BINARY_QUANTIZE_SQL.format(vector=vector)})"
+        )
+
     def insert_node(self, node: Node) -> uuid.UUID:
         if node.vector and not self._validate_vector(node.vector):
             logger.error("Invalid vector: Must be a list of float values.")
             return None
         try:
-            with self.transaction():
+            with self._write_lock:
                 result = self.conn.execute(
-                    "INSERT INTO nodes (id, type, properties, vector) VALUES (?, ?, ?, ?) RETURNING id;",
-                    (str(node.id), node.type, json.dumps(node.properties), node.vector if node.vector else [0.0] * self.vector_length)
+                    f"{self._insert_node_sql()} RETURNING id;",
+                    (node.id, node.type, json.dumps(node.properties), json.dumps(node.vector if node.vector else [0.0] * self.vector_length))
                 ).fetchone()
-                if result:
-                    logger.info(f"Node inserted with ID: {result[0]}")
-                return result[0] if result else None
+            if result:
+                logger.debug("Node inserted with ID: %s", result[0])
+            return result[0] if result else None
         except duckdb.Error as e:
             logger.error(f"Error during insert node: {e}")
             return None
 
     def insert_edge(self, edge: Edge):
         try:
-            with self.transaction():
-                # Check if source and target nodes exist
-                source_exists = self.conn.execute(
-                    "SELECT 1 FROM nodes WHERE id = ?", (str(edge.source_id),)).fetchone()
-                target_exists = self.conn.execute(
-                    "SELECT 1 FROM nodes WHERE id = ?", (str(edge.target_id),)).fetchone()
-                if not source_exists or not target_exists:
-                    raise ValueError("Source or target node does not exist.")
-
-                self.conn.execute("INSERT INTO edges (id, source_id, target_id, relation, weight) VALUES (?, ?, ?, ?, ?);", (
-                    str(edge.id), str(edge.source_id), str(edge.target_id), edge.relation, edge.weight))
+            # The existence check is part of the insert
+            with self._write_lock:
+                inserted = self.conn.execute(
+                    "INSERT INTO edges (id, source_id, target_id, relation, weight) SELECT $1, $2, $3, $4, $5 "
+                    "WHERE EXISTS (SELECT 1 FROM nodes WHERE id = $2) AND EXISTS (SELECT 1 FROM nodes WHERE id = $3);",
+                    (edge.id, edge.source_id, edge.target_id, edge.relation, edge.weight)
+                ).fetchone()[0]
+            if not inserted:
+                raise ValueError("Source or target node does not exist.")
         except duckdb.Error as e:
             logger.error(f"Error during insert edge: {e}")
         except ValueError as e:
             logger.error(f"Error during insert edge: {e}")
             raise
 
-    def bulk_insert_nodes(self, nodes: List[Node]) -> List[Node]:
-        try:
-            with self.transaction():
-                for node in nodes:
-                    result = self.conn.execute(
-                        "INSERT INTO nodes (id, type, properties, vector) VALUES (?, ?, ?, ?) RETURNING id;",
-                        (str(node.id), node.type, json.dumps(node.properties), node.vector if node.vector else None)
-                    ).fetchone()
-                    if result:
-                        node.id = result[0]
-                return nodes
-        except duckdb.Error as e:
-            logger.error(f"Error during bulk insert nodes: {e}")
-            return []
+    def _bulk_insert_nodes_sql(self):
+        # Unpack a JSON array of nodes server-side, so the whole batch is a single parameter and statement
+        rows = ("unnest(json_transform(CAST($1 AS JSON), "
+                "'[{\"id\": \"UUID\", \"type\": \"VARCHAR\", \"properties\": \"JSON\", \"vector\": \"FLOAT[]\"}]')) AS r")
+        return (
+            "INSERT INTO nodes (id, type, properties, vector, vector_bin) "
+            f"SELECT id, type, properties, vector, {BINARY_QUANTIZE_SQL.format(vector='vector')} "
+            f"FROM (SELECT r.id, r.type, r.properties, CAST(r.vector AS FLOAT[{self.vector_length}]) AS vector "
+            f"FROM (SELECT {rows}));"
+        )
+
+    def bulk_insert_nodes(self, nodes: Iterable[Node], defer_index: bool = False) -> List[Node]:
+        # Node ids are generated client-side, so no ids need to be read back from the insert
+        nodes = list(nodes)
+        if not nodes:
+            return nodes
+        with self._write_lock:
+            # Rather than updating the HNSW index row by row, drop it and build it once after the insert
+            rebuild_index = defer_index and self._has_vector_index()
+            try:
+                with self.transaction():
+                    if rebuild_index:
+                        self.conn.execute("DROP INDEX vss_idx;")
+                    self.conn.execute(
+                        self._bulk_insert_nodes_sql(),
+                        (json.dumps([{"id": str(node.id), "type": node.type, "properties": node.properties,
+                                      "vector": node.vector if node.vector else None} for node in nodes]),)
+                    )
+                    # Rebuilt in the same transaction, so other connections never see the table without it
+                    if rebuild_index:
+                        self._create_index()
+            except duckdb.Error as e:
+                logger.error(f"Error during bulk insert nodes: {e}")
+                return []
+            finally:
+                # The rebuild may have failed or been rolled back with the insert
+                if rebuild_index:
+                    self._refresh_vector_index()
+        logger.info("Inserted %d nodes.", len(nodes))
+        return nodes
 
     def bulk_insert_edges(self, edges: List[Edge]):
         try:
-            with self.transaction():
-                self.conn.executemany(
-                    "INSERT INTO edges (id, source_id, target_id, relation, weight) VALUES (?, ?, ?, ?, ?);",
-                    [(str(edge.id), str(edge.source_id), str(edge.target_id), edge.relation, edge.weight)
-                     for edge in edges]
+            with self._write_lock:
+                self.conn.execute(
+                    BULK_INSERT_EDGES_SQL,
+                    (json.dumps([{"id": str(edge.id), "source_id": str(edge.source_id), "target_id": str(edge.target_id),
+                                  "relation": edge.relation, "weight": edge.weight} for edge in edges]),)
                 )
+            logger.info("Inserted %d edges.", len(edges))
         except duckdb.Error as e:
             logger.error(f"Error during bulk insert edges: {e}")
 
     def delete_node(self, node_id: uuid.UUID):
         try:
-            with self.transaction():
-                self.conn.execute(
-                    "DELETE FROM nodes WHERE id = ?;", (str(node_id),))
-                self.conn.execute(
-                    "DELETE FROM edges WHERE source_id = ? OR target_id = ?;", (str(node_id), str(node_id)))
+            # Edges go first so the foreign keys no longer reference the node. DuckDB checks foreign keys
+            # against the committed state, so the two deletes cannot share a transaction (or a batch()).
+            with self._write_lock:
+                self.conn.execute("DELETE FROM edges WHERE source_id = $1 OR target_id = $1;", (node_id,))
+                self.conn.execute("DELETE FROM nodes WHERE id = $1;", (node_id,))
         except duckdb.Error as e:
             logger.error(f"Error deleting node: {e}")
 
     def delete_edge(self, source_id: uuid.UUID, target_id: uuid.UUID):
         try:
-            with self.transaction():
-                self.conn.execute(
-                    "DELETE FROM edges WHERE source_id = ? AND target_id = ?;", (str(source_id), str(target_id)))
+            with self._write_lock:
+                self.conn.execute("DELETE FROM edges WHERE source_id = $1 AND target_id = $2;", (source_id, target_id))
         except duckdb.Error as e:
             logger.error(f"Error deleting edge: {e}")
 
-    def create_index(self):
+    def _index_metric(self):
+        # Metric of the existing vss_idx, or None without one
+        row = self.conn.execute(
+            "SELECT metric FROM pragma_hnsw_index_info() "
+            "WHERE index_name = 'vss_idx' AND catalog_name = current_database();").fetchone()
+        return row[0] if row else None
+
+    def _has_vector_index(self):
+        return self._index_metric() is not None
+
+    def _refresh_vector_index(self):
+        # nearest_nodes only searches an index built with this instance's metric, a database
+        # opened with a different metric or a failed rebuild falls back to the exact scan
+        self._vector_index = self._index_metric() == HNSW_METRICS[self.metric] and self._index_scan_planned()
+
+    def _index_scan_planned(self):
+        # The cosine and ip queries order by ascending similarity, which is only nearest-first when VSS
+        # answers them from the index. The plan is checked once per build rather than trusting the rewrite.
+        # EXPLAIN does not take parameters, so a zero vector and limit are inlined.
+        query = self._nearest_sql["hnsw"].replace("$1", f"'{_vector_json([0.0] * self.vector_length)}'").replace("$2", "1")
         try:
-            self.conn.execute(
-                "CREATE INDEX IF NOT EXISTS vss_idx ON nodes USING HNSW(vector);")
+            return "HNSW_INDEX_SCAN" in self.conn.execute(f"EXPLAIN {query}").fetchone()[1]
+        except duckdb.Error as e:
+            logger.error(f"Error checking the index plan: {e}")
+            return False
+
+    def _create_index(self):
+        try:
+            with self._write_lock:
+                metric = self._index_metric()
+                if metric is not None and metric != HNSW_METRICS[self.metric]:
+                    logger.warning(f"Rebuilding index built with metric '{metric}' for metric '{HNSW_METRICS[self.metric]}'.")
+                    self.conn.execute("DROP INDEX vss_idx;")
+                self.conn.execute(
+                    "CREATE INDEX IF NOT EXISTS vss_idx ON nodes USING HNSW(vector) WITH ("
+                    f"metric = '{HNSW_METRICS[self.metric]}', M = {int(self.m)}, "
+                    f"ef_construction = {int(self.ef_construction)}, ef_search = {int(self.ef_search)});")
         except duckdb.Error as e:
             logger.error(f"Error creating index: {e}")
+        self._refresh_vector_index()
 
-    def nearest_nodes(self, vector: List[float], limit: int) -> List[NearestNode]:
+    def create_index(self):
+        # VSS updates the index on every insert, so once it exists this only compacts it,
+        # dropping the entries of deleted nodes instead of rebuilding it over all rows
+        with self._write_lock:
+            if not self._has_vector_index():
+                self._create_index()
+                return
+            try:
+                self.conn.execute("PRAGMA hnsw_compact_index('vss_idx');")
+            except duckdb.Error as e:
+                logger.error(f"Error compacting index: {e}")
+
+    def set_ef_search(self, ef_search):
+        # Size of the HNSW candidate list at query time, higher trades latency for recall.
+        # Set globally so the reader cursors of every thread pick it up.
+        try:
+            self.conn.execute(f"SET GLOBAL hnsw_ef_search = {int(ef_search)};")
+            self.ef_search = ef_search
+        except duckdb.Error as e:
+            logger.error(f"Error setting ef_search: {e}")
+
+    def _build_nearest_sql(self):
+        # nearest_nodes queries only depend on the vector length and metric, so build them once per change
+        query_vector = f"CAST($1 AS FLOAT[{self.vector_length}])"
+        distance = DISTANCE_SQL[self.metric]
+        self._nearest_sql = {
+            # Exact scan. The id tie-break keeps VSS from rewriting it onto the HNSW index.
+            "float32": f"""
+            SELECT id, type, properties, vector, {distance.format(vector='vector', query=query_vector)} AS distance
+            FROM nodes
+            WHERE vector IS NOT NULL
+            ORDER BY distance, id LIMIT $2;
+            """,
+            # Pre-filter limit * oversample candidates by Hamming distance, then rescore them in float32
+            "binary": f"""
+            WITH candidates AS (
+                SELECT id
+                FROM nodes
+                WHERE vector_bin IS NOT NULL
+                ORDER BY bit_count(xor(vector_bin, {BINARY_QUANTIZE_SQL.format(vector=query_vector)}))
+                LIMIT $2 * $3
+            )
+            SELECT n.id, n.type, n.properties, n.vector, {distance.format(vector='n.vector', query=query_vector)} AS distance
+            FROM nodes n
+            JOIN candidates c ON n.id = c.id
+            ORDER BY distance LIMIT $2;
+            """,
+        }
+        # The l2 distance is answered from the index as is, cosine and ip need the similarity form
+        self._nearest_sql["hnsw"] = f"""
+            SELECT id, type, properties, vector, {distance.format(vector='vector', query=query_vector)} AS distance
+            FROM nodes
+            WHERE vector IS NOT NULL
+            ORDER BY distance LIMIT $2;
+            """
+        if self.metric in HNSW_SIMILARITY_SQL:
+            similarity, distance = HNSW_SIMILARITY_SQL[self.metric]
+            self._nearest_sql["hnsw"] = f"""
+            SELECT id, type, properties, vector, {distance} AS distance
+            FROM (
+                SELECT id, type, properties, vector, {similarity.format(vector='vector', query=query_vector)} AS similarity
+                FROM nodes
+                WHERE vector IS NOT NULL
+                ORDER BY similarity LIMIT $2
+            )
+            ORDER BY distance;
+            """
+
+    def nearest_nodes(self, vector: Sequence[float], limit: int, precision: str = "float32", oversample: int = 4) -> List[NearestNode]:
         if not self._validate_vector(vector):
             logger.error("Invalid vector: Must be a list of float values.")
             return []
-
-        query = f"""
-        SELECT id, type, properties, vector, array_distance(vector, CAST(? AS FLOAT[{self.vector_length}])) AS distance
-        FROM nodes
-        WHERE vector IS NOT NULL
-        ORDER BY distance LIMIT ?;
-        """
+        if precision not in ("float32", "binary"):
+            logger.error(f"Unsupported precision: {precision}")
+            return []
+        conn = self._reader()
+        use_index = False
+        # VSS adds rows without a vector to the index, where they take top-k slots before WHERE vector IS NOT NULL
+        # drops them. The index is only searched while every node has a vector, otherwise the exact scan is used.
+        # The index does not see this thread's uncommitted writes either, so searches inside a transaction scan.
+        if precision == "float32" and self._vector_index and self._transaction_thread != threading.get_ident() \
+                and not conn.execute(
+                "SELECT EXISTS (SELECT 1 FROM nodes WHERE vector IS NULL);").fetchone()[0]:
+            use_index = True
+        # The query vector is sent as JSON text and cast server-side, binding a list costs one Python value per element.
+        # Elements that are not numbers fail the cast and are reported below.
+        vector_json = _vector_json(vector)
+        params = (vector_json, limit, oversample) if precision == "binary" else (vector_json, limit)
         try:
-            results = self.conn.execute(query, (vector, limit)).fetchall()
+            results = conn.execute(self._nearest_sql["hnsw" if use_index else precision], params).fetchall()
+            # The index can return fewer than limit rows, ex: VSS's ip index over vectors that are not
+            # unit length, so a short result is rerun as the exact scan
+            if use_index and len(results) < limit:
+                results = conn.execute(self._nearest_sql["float32"], params).fetchall()
             return [
-                NearestNode(
-                    node=Node(id=row[0], type=row[1], properties=json.loads(row[2]), vector=row[3]),
-                    distance=row[4]
-                ) for row in results
+                NearestNode.model_construct(node=_node_from_row(row, properties), distance=row[4])
+                for row, properties in zip(results, _loads_many(row[2] for row in results))
             ]
         except duckdb.Error as e:
             logger.error(f"Error fetching nearest neighbors: {e}")
             return []
 
-    def connected_nodes(self, node_id: uuid.UUID) -> List[Node]:
-        query = """
-        SELECT n.id, n.type, n.properties, n.vector
+    def connected_nodes(self, node_id: uuid.UUID, include_vector: bool = False) -> List[Node]:
+        # Both neighbor lookups are index scans on edges, deduplicated on ids before joining to nodes.
+        # Vectors are only read when asked for, otherwise Node.vector is None.
+        query = f"""
+        WITH neighbors AS (
+            SELECT DISTINCT id FROM (
+                SELECT target_id AS id FROM edges WHERE source_id = $1
+                UNION ALL
+                SELECT source_id AS id FROM edges WHERE target_id = $1
+            )
+        )
+        SELECT n.id, n.type, n.properties, {'n.vector' if include_vector else 'NULL AS vector'}
         FROM nodes n
-        WHERE n.id IN (
-                SELECT target_id FROM edges WHERE source_id = ?
-                UNION
-                SELECT source_id FROM edges WHERE target_id = ?
-            );
+        JOIN neighbors USING (id);
         """
         try:
-            logger.info(
-                f"Executing query to fetch connected nodes for node_id: {node_id}")
-            results = self.conn.execute(query, (str(node_id), str(node_id))).fetchall()
+            # uuid.UUID binds natively, a string id is cast by DuckDB
+            results = self._reader().execute(query, (node_id,)).fetchall()
             if results:
-                connected_nodes = [Node(id=uuid.UUID(str(row[0])), type=row[1], properties=json.loads(row[2]), vector=row[3]) for row in results]
-                logger.info(f"Found {len(connected_nodes)} connected nodes.")
+                connected_nodes = [_node_from_row(row, properties)
+                                   for row, properties in zip(results, _loads_many(row[2] for row in results))]
+                logger.debug("Found %d connected nodes.", len(connected_nodes))
             else:
                 connected_nodes = []
-                logger.info("No connected nodes found.")
+                logger.debug("No connected nodes found.")
             return connected_nodes
         except duckdb.Error as e:
             logger.error(f"Error fetching connected nodes: {e}")
             return []
 
-    def nodes_to_json(self) -> List[D[str, Any]]:
+    def _json_array(self, fields, table):
+        # The whole JSON document is built by DuckDB, so no Python object is created per row
+        pairs = ", ".join(f"'{name}', {column}" for name, column in fields)
+        return self._reader().execute(
+            f"SELECT COALESCE(json_group_array(json_object({pairs})), '[]') FROM {table};").fetchone()[0]
+
+    def nodes_to_json(self, include_vector: bool = True, raw: bool = False) -> Union[List[D[str, Any]], str]:
+        # raw=True returns the serialized JSON array as a string instead of a list of dicts
         try:
-            nodes = self.conn.execute(
-                "SELECT id, type, properties, vector FROM nodes;").fetchall()
-            return [{"id": str(row[0]), "type": row[1], "properties": json.loads(row[2]), "vector": row[3]} for row in nodes]
+            if raw:
+                return self._json_array([("id", "id::VARCHAR"), ("type", "type"), ("properties", "properties"),
+                                         ("vector", "vector" if include_vector else "NULL")], "nodes")
+            nodes = self._reader().execute(
+                f"SELECT id::VARCHAR, type, properties, {'vector' if include_vector else 'NULL AS vector'} FROM nodes;").fetchall()
+            return [{"id": row[0], "type": row[1], "properties": properties, "vector": row[3]}
+                    for row, properties in zip(nodes, _loads_many(row[2] for row in nodes))]
         except duckdb.Error as e:
             logger.error(f"Error fetching nodes: {e}")
-            return []
+            return "[]" if raw else []
 
-    def edges_to_json(self) -> List[D[str, Any]]:
+    def edges_to_json(self, raw: bool = False) -> Union[List[D[str, Any]], str]:
         try:
-            edges = self.conn.execute(
-                "SELECT id, source_id, target_id, relation, weight FROM edges;").fetchall()
-            return [{"id": str(row[0]), "source_id": str(row[1]), "target_id": str(row[2]), "relation": row[3], "weight": row[4]} for row in edges]
+            if raw:
+                return self._json_array([("id", "id::VARCHAR"), ("source_id", "source_id::VARCHAR"),
+                                         ("target_id", "target_id::VARCHAR"), ("relation", "relation"),
+                                         ("weight", "weight")], "edges")
+            edges = self._reader().execute(
+                "SELECT id::VARCHAR, source_id::VARCHAR, target_id::VARCHAR, relation, weight FROM edges;").fetchall()
+            return [{"id": row[0], "source_id": row[1], "target_id": row[2], "relation": row[3], "weight": row[4]} for row in edges]
         except duckdb.Error as e:
             logger.error(f"Error fetching edges: {e}")
-            return []
+            return "[]" if raw else []
 
-    def get_node(self, node_id: uuid.UUID) -> Node:
+    def get_node(self, node_id: uuid.UUID, include_vector: bool = True) -> Node:
         try:
-            node = self.conn.execute(
-                "SELECT id, type, properties, vector FROM nodes WHERE id = ?;", (str(node_id),)).fetchone()
+            node = self._execute_prepared("get_node" if include_vector else "get_node_meta", node_id,
+                                          conn=self._reader()).fetchone()
             if node:
-                return Node(id=node[0], type=node[1], properties=json.loads(node[2]), vector=node[3])
+                return _node_from_row(node, json.loads(node[2]))
             else:
                 return None
-        except duckdb.Error as e:
+        except (duckdb.Error, ValueError) as e:
             logger.error(f"Error fetching node: {e}")
             return None
 
-    def nodes_by_attribute(self, attribute, value) -> List[Node]:
+    def nodes_by_attribute(self, attribute, value, include_vector: bool = False) -> List[Node]:
         try:
-            query = f"SELECT id, type, properties, vector FROM nodes WHERE json_extract(properties, '$.{attribute}') = ?;"
-            nodes = self.conn.execute(query, (json.dumps(value),)).fetchall()
+            # The JSON path is bound like the value, so the statement text is the same for every attribute
+            query = (f"SELECT id, type, properties, {'vector' if include_vector else 'NULL AS vector'} "
+                     "FROM nodes WHERE json_extract(properties, $1) = $2;")
+            nodes = self._reader().execute(query, (f"$.{attribute}", json.dumps(value))).fetchall()
             if nodes:
-                return [Node(id=row[0], type=row[1], properties=json.loads(row[2]), vector=row[3]) for row in nodes]
+                return [_node_from_row(row, properties)
+                        for row, properties in zip(nodes, _loads_many(row[2] for row in nodes))]
             else:
                 return []
         except duckdb.Error as e:
@@ -264,10 +743,9 @@ class GraphMemory:
 
     def get_nodes_vector(self, node_id: int) -> List[float]:
         try:
-            vector = self.conn.execute(
-                "SELECT vector FROM nodes WHERE id = ?;", (node_id,)).fetchone()
+            vector = self._execute_prepared("get_nodes_vector", node_id, conn=self._reader()).fetchone()
             return vector[0] if vector else []
-        except duckdb.Error as e:
+        except (duckdb.Error, ValueError) as e:
             logger.error(f"Error fetching vector: {e}")
             return []
 
@@ -278,10 +756,10 @@ class GraphMemory:
         print("Edges JSON:", json.dumps(edges_json, indent=2))
 
     def cypher(self, cypher_query):
-        sql_query = self._cypher_to_sql(cypher_query)
+        sql_query, params = self._cypher_to_sql(cypher_query)
         try:
-            results = self.conn.execute(sql_query).fetchall()
-            logger.debug(f"Query results: {results}")
+            results = self._reader().execute(sql_query, params).fetchall()
+            logger.debug("Query results: %s", results)
             return results
         except duckdb.Error as e:
             logger.error(f"Error executing SQL query: {e}")
@@ -289,137 +767,53 @@ class GraphMemory:
    
 
     def _cypher_to_sql(self, cypher_query):
-        import re
-        import json  # Added import for json
-        # Define regex patterns for nodes, relationships, and properties
-        node_pattern = re.compile(r"\((\w+)(?::(\w+))?(?:\s*{([^}]+)})?\)")
-        rel_pattern = re.compile(r"\[(\w+)?(?::(\w+))?(?:\s*{([^}]+)})?\]")
-        
-        # Helper function to parse properties
-        def parse_properties(prop_string):
-            properties = {}
-            if prop_string:
-                props = prop_string.split(',')
-                for prop in props:
-                    key, value = prop.split(':')
-                    value = value.strip().strip('"\'')
-                    if value.isdigit():
-                        value = int(value)
-                    elif re.match(r"^\d+?\.\d+?$", value):
-                        value = float(value)
-                    properties[key.strip()] = value
-            return properties
-
-        # Extract MATCH clause
-        match_clause = re.search(r'MATCH\s+(.*)\s+RETURN', cypher_query, re.IGNORECASE)
-        if not match_clause:
-            raise ValueError("Invalid Cypher query: missing MATCH or RETURN clause")
-        match_content = match_clause.group(1).strip()
-
-        # Extract RETURN clause
-        return_clause = re.search(r'RETURN\s+(.*)', cypher_query, re.IGNORECASE)
-        if not return_clause:
-            raise ValueError("Invalid Cypher query: missing RETURN clause")
-        return_content = return_clause.group(1).strip().split(',')
-
-        # Parse nodes and relationships together
-        elements = re.split(r'(\[.*?\])', match_content)
-
-        nodes = []
-        relationships = []
-        for elem in elements:
-            if '(' in elem:
-                match = node_pattern.search(elem)
-                if match:
-                    alias, label, prop_string = match.groups()
-                    nodes.append({
-                        "alias": alias,
-                        "label": label,
-                        "properties": parse_properties(prop_string)
-                    })
-            elif '[' in elem:
-                match = rel_pattern.search(elem)
-                if match:
-                    alias, label, prop_string = match.groups()
-                    relationships.append({
-                        "alias": alias or f"r{len(relationships)+1}",
-                        "label": label,
-                        "properties": parse_properties(prop_string)
-                    })
-
-        # Start building the SQL query
-        sql_query = "SELECT "
-        sql_parts = []
-
-        # Determine what is being returned
-        for item in return_content:
-            item = item.strip()
-            if '.' in item:
-                alias, field = item.split('.')
-                if field == "embedding":
-                    sql_parts.append(f"{alias}.{field}")
-            else:
-                sql_parts.append("*")
-
-        if not sql_parts:
-            sql_parts.append("*")
-
-        from_clause = []
-        where_conditions = []
-
-        # Process nodes and relationships in sequence
-        for i, node in enumerate(nodes):
-            alias, label, properties = node.values()
-            if i == 0:
-                from_clause.append(f"nodes AS {alias}")
-            else:
-                prev_node = nodes[i-1]['alias']
-                rel = relationships[i-1]
-                rel_alias, rel_label, rel_properties = rel.values()
-                from_clause.append(f"JOIN nodes AS {alias} ON {prev_node}.id = {rel_alias}.start_node_id AND {alias}.id = {rel_alias}.end_node_id")
-            
-            if label:
-                where_conditions.append(f"{alias}.type = '{label}'")
-            for prop, val in properties.items():
-                if prop == "embedding":
-                    sql_parts.append(f"{alias}.embedding")
-                else:
-                    if isinstance(val, (int, float)):
-                        where_conditions.append(f"json_extract({alias}.properties, '$.{prop}') = json('{val}')")
-                    else:
-                        where_conditions.append(f"json_extract({alias}.properties, '$.{prop}') = json('{json.dumps(val)}')")
-        
-        for rel in relationships:
-            rel_alias, rel_label, rel_properties = rel.values()
-            if rel_label:
-                where_conditions.append(f"{rel_alias}.type = '{rel_label}'")
-            for prop, val in rel_properties.items():
-                if isinstance(val, (int, float)):
-                    where_conditions.append(f"json_extract({rel_alias}.properties, '$.{prop}') = json('{val}')")
-                else:
-                    where_conditions.append(f"json_extract({rel_alias}.properties, '$.{prop}') = json('{json.dumps(val)}')")
-
-        sql_query += ", ".join(sql_parts)
-        sql_query += " FROM " + " ".join(from_clause)
-
-        if where_conditions:
-            sql_query += " WHERE " + " AND ".join(where_conditions)
-
-        return sql_query + ";"
-
+        return _cypher_to_sql(cypher_query)
 
     def _validate_vector(self, vector):
-        return isinstance(vector, list) and len(vector) == self.vector_length and all(isinstance(x, float) for x in vector)
+        # Only the shape is checked here. Node vectors are already validated as floats by pydantic,
+        # and any non-numeric element fails the server-side cast to FLOAT[n].
+        if isinstance(vector, (str, bytes)) or not hasattr(vector, "__len__"):
+            return False
+        # One-dimensional array-likes such as numpy arrays are accepted as well as lists and tuples
+        return getattr(vector, "ndim", 1) == 1 and len(vector) == self.vector_length
 
     @contextmanager
     def transaction(self):
-        try:
-            self.conn.execute("BEGIN TRANSACTION;")
-            yield
-            self.conn.execute("COMMIT;")
-        except Exception as e:
-            self.conn.execute("ROLLBACK;")
-            raise e
+        # Single statements already commit on their own; this is for work spanning several statements.
+        # A nested transaction joins the outer one, which commits or rolls back everything.
+        # The write lock is held throughout, so other threads' writes wait for the commit.
+        with self._write_lock:
+            if self._transaction_depth:
+                self._transaction_depth += 1
+                try:
+                    yield
+                finally:
+                    self._transaction_depth -= 1
+                return
+            self.conn.begin()
+            self._transaction_depth = 1
+            self._transaction_thread = threading.get_ident()
+            try:
+                yield
+                # The public methods log and swallow their errors, but a failed statement still aborts the
+                # transaction and commit() would then silently discard every write in it. Any statement
+                # fails on an aborted transaction, so one is run to detect it before committing.
+                try:
+                    self.conn.execute("SELECT 1;")
+                except duckdb.Error:
+                    raise duckdb.TransactionException(
+                        "Transaction aborted by an earlier error, none of its writes were committed.")
+                self.conn.commit()
+            except Exception as e:
+                self.conn.rollback()
+                raise e
+            finally:
+                self._transaction_depth = 0
+                self._transaction_thread = None
+
+    def batch(self):
+        # Group many calls, ex: insert_node and insert_edge in a loop, into one transaction and one commit
+        return self.transaction()
 
     def __enter__(self):
         return self
@@ -1,6 +1,9 @@
+import array
 import json
 import sys
+import tempfile
 import os
+import threading
 import uuid
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
 import duckdb
@@ -14,6 +17,12 @@ class TestGraphMemory(unittest.TestCase):
     def setUp(self):
         self.db = GraphMemory(database=':memory:', vector_length=3)
 
+    def test_connection_config(self):
+        db = GraphMemory(database=':memory:', vector_length=3, config={"checkpoint_threshold": "256MB"})
+        result = db.conn.execute("SELECT value FROM duckdb_settings() WHERE name = 'checkpoint_threshold'").fetchone()
+        self.assertEqual(result[0], "244.1 MiB")
+        db.conn.close()
+
     def test_insert_node(self):
         node = Node(properties={"name": "node1"}, vector=[0.1, 0.2, 0.3])
         node_id = self.db.insert_node(node)
@@ -31,6 +40,20 @@ class TestGraphMemory(unittest.TestCase):
             node = Node(properties={"name": "node1"}, vector=[0.1, 0.2, "invalid"])
             self.db.insert_node(node)
 
+    def test_insert_quoted_values(self):
+        node = Node(type="Person's", properties={"name": "O'Brien"}, vector=[0.1, 0.2, 0.3])
+        node_id = self.db.insert_node(node)
+        self.db.insert_edge(Edge(source_id=node_id, target_id=node_id, relation="it's", weight=0.5))
+        fetched = self.db.get_node(node_id)
+        self.assertEqual((fetched.type, fetched.properties), ("Person's", {"name": "O'Brien"}))
+        self.assertEqual(self.db.edges_to_json()[0]["relation"], "it's")
+
+    def test_insert_nul_values(self):
+        node_id = self.db.insert_node(Node(type="a\x00b", properties={"name": "node1"}, vector=[0.1, 0.2, 0.3]))
+        self.db.insert_edge(Edge(source_id=node_id, target_id=node_id, relation="c\x00d", weight=0.5))
+        self.assertEqual(self.db.get_node(node_id).type, "a\x00b")
+        self.assertEqual(self.db.edges_to_json()[0]["relation"], "c\x00d")
+
     def test_insert_node_invalid_vector_length(self):
         node = Node(properties={"name": "node1"}, vector=[0.1, 0.2])
         result = self.db.insert_node(node)
@@ -55,6 +78,14 @@ class TestGraphMemory(unittest.TestCase):
         with self.assertRaises(ValueError):
             self.db.insert_edge(edge)
 
+    def test_insert_edge_one_missing_node(self):
+        node_id = self.db.insert_node(Node(properties={"name": "node1"}, vector=[0.1, 0.2, 0.3]))
+        with self.assertRaises(ValueError):
+            self.db.insert_edge(Edge(source_id=node_id, target_id=uuid.uuid4(), relation="friendship"))
+        self.db.insert_edge(Edge(source_id=node_id, target_id=node_id, relation="self"))
+        result = self.db.conn.execute("SELECT relation FROM edges").fetchall()
+        self.assertEqual(result, [("self",)])
+
     def test_nearest_nodes_empty_db(self):
         neighbors = self.db.nearest_nodes(vector=[0.1, 0.2, 0.3], limit=2)
         self.assertEqual(len(neighbors), 0)
@@ -73,6 +104,156 @@ class TestGraphMemory(unittest.TestCase):
         self.assertEqual(neighbors[0].node.properties["name"], "node1")
         self.assertEqual(neighbors[1].node.properties["name"], "node2")
 
+    def test_nearest_nodes_binary(self):
+        nodes = [
+            Node(properties={"name": "node1"}, vector=[0.1, -0.2, 0.3]),
+            Node(properties={"name": "node2"}, vector=[-0.4, 0.5, -0.6]),
+            Node(properties={"name": "node3"}, vector=[0.7, 0.8, -0.9])
+        ]
+        for node in nodes:
+            self.db.insert_node(node)
+        neighbors = self.db.nearest_nodes(vector=[0.1, -0.2, 0.3], limit=1, precision="binary", oversample=2)
+        self.assertEqual(len(neighbors), 1)
+        self.assertEqual(neighbors[0].node.properties["name"], "node1")
+        self.assertAlmostEqual(neighbors[0].distance, 0.0, places=5)
+
+    def test_nearest_nodes_metrics(self):
+        for metric in ("cosine", "ip"):
+            db = GraphMemory(database=':memory:', vector_length=3, metric=metric)
+            db.insert_node(Node(properties={"name": "node1"}, vector=[1.0, 0.0, 0.0]))
+            db.insert_node(Node(properties={"name": "node2"}, vector=[0.0, 1.0, 0.0]))
+            db.insert_node(Node(properties={"name": "node3"}, vector=[0.6, 0.8, 0.0]))
+            db.create_index()
+            neighbors = db.nearest_nodes(vector=[0.8, 0.6, 0.0], limit=2)
+            self.assertEqual([n.node.properties["name"] for n in neighbors], ["node3", "node1"])
+            self.assertAlmostEqual(neighbors[0].distance, 0.04 if metric == "cosine" else -0.96, places=5)
+            db.conn.close()
+
+    def test_vector_index_created(self):
+        db = GraphMemory(database=':memory:', vector_length=3, m=8, ef_construction=32, ef_search=16)
+        # The index is opt-in, nearest_nodes scans until create_index builds it
+        result = db.conn.execute("SELECT COUNT(*) FROM duckdb_indexes() WHERE index_name = 'vss_idx'").fetchone()
+        self.assertEqual(result[0], 0)
+        db.create_index()
+        result = db.conn.execute("SELECT COUNT(*) FROM duckdb_indexes() WHERE index_name = 'vss_idx'").fetchone()
+        self.assertEqual(result[0], 1)
+        db.set_ef_search(100)
+        result = db.conn.execute("SELECT value FROM duckdb_settings() WHERE name = 'hnsw_ef_search'").fetchone()
+        self.assertEqual(result[0], "100")
+        db.conn.close()
+
+    def test_create_index_compacts(self):
+        self.db.create_index()
+        node = Node(properties={"name": "node1"}, vector=[0.1, 0.2, 0.3])
+        self.db.insert_node(node)
+        self.db.insert_node(Node(properties={"name": "node2"}, vector=[0.4, 0.5, 0.6]))
+        self.db.delete_node(node.id)
+        # The index already exists, so this compacts it rather than creating another one
+        self.db.create_index()
+        result = self.db.conn.execute("SELECT COUNT(*) FROM duckdb_indexes() WHERE index_name = 'vss_idx'").fetchone()
+        self.assertEqual(result[0], 1)
+        neighbors = self.db.nearest_nodes(vector=[0.1, 0.2, 0.3], limit=2)
+        self.assertEqual([n.node.properties["name"] for n in neighbors], ["node2"])
+
+    def test_nearest_nodes_vectorless_nodes(self):
+        for metric in ("l2", "cosine", "ip"):
+            db = GraphMemory(database=':memory:', vector_length=3, metric=metric)
+            db.create_index()
+            nodes = [Node(properties={"i": i}, vector=[1.0, i / 20, 0.5]) for i in range(20)]
+            # Nodes without a vector are stored as NULL and must not take any of the results
+            nodes += [Node(properties={"i": i}) for i in range(20, 30)]
+            db.bulk_insert_nodes(nodes)
+            self.assertEqual(len(db.nearest_nodes(vector=[1.0, 0.0, 0.5], limit=5)), 5)
+            db.conn.close()
+
+    def test_nearest_nodes_in_batch(self):
+        self.db.create_index()
+        self.db.insert_node(Node(properties={"name": "far"}, vector=[0.9, 0.9, 0.9]))
+        with self.db.batch():
+            self.db.insert_node(Node(properties={"name": "near"}, vector=[0.1, 0.2, 0.3]))
+            neighbors = self.db.nearest_nodes(vector=[0.1, 0.2, 0.3], limit=1)
+        self.assertEqual(neighbors[0].node.properties["name"], "near")
+
+    def test_reopen_with_other_metric(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "graph.db")
+            db = GraphMemory(database=path, vector_length=3)
+            db.insert_node(Node(properties={"name": "node1"}, vector=[1.0, 0.0, 0.0]))
+            db.insert_node(Node(properties={"name": "node2"}, vector=[0.0, 1.0, 0.0]))
+            db.insert_node(Node(properties={"name": "node3"}, vector=[0.6, 0.8, 0.0]))
+            db.create_index()
+            db.conn.close()
+            for metric in ("cosine", "ip"):
+                # The l2 index left in the file is rebuilt with the new metric
+                db = GraphMemory(database=path, vector_length=3, metric=metric)
+                neighbors = db.nearest_nodes(vector=[0.8, 0.6, 0.0], limit=1)
+                self.assertEqual(neighbors[0].node.properties["name"], "node3")
+                db.conn.close()
+
+    def test_nearest_nodes_uses_index(self):
+        for metric in ("l2", "cosine", "ip"):
+            db = GraphMemory(database=':memory:', vector_length=3, metric=metric)
+            db.insert_node(Node(properties={"name": "node1"}, vector=[1.0, 0.0, 0.0]))
+            db.create_index()
+            # EXPLAIN does not take parameters, so they are inlined
+            query = db._nearest_sql["hnsw"].replace("$1", "'[1.0, 0.0, 0.0]'").replace("$2", "1")
+            plan = db.conn.execute("EXPLAIN " + query).fetchone()[1]
+            self.assertIn("HNSW_INDEX_SCAN", plan)
+            db.conn.close()
+
+    def test_nearest_nodes_index_short_results(self):
+        db = GraphMemory(database=':memory:', vector_length=3, metric="ip")
+        db.create_index()
+        # VSS's ip index returns fewer than limit rows over these vectors, which are not unit length
+        db.bulk_insert_nodes([Node(vector=[1.0 + i % 7, 2.0 + i % 5, 3.0 + i % 3]) for i in range(500)])
+        self.assertEqual(len(db.nearest_nodes(vector=[1.0, 2.0, 3.0], limit=300)), 300)
+        db.conn.close()
+
+    def test_nearest_nodes_unplanned_index(self):
+        db = GraphMemory(database=':memory:', vector_length=3, metric="cosine")
+        db.insert_node(Node(properties={"name": "node1"}, vector=[1.0, 0.0, 0.0]))
+        db.insert_node(Node(properties={"name": "node2"}, vector=[0.0, 1.0, 0.0]))
+        db.create_index()
+        self.assertTrue(db._vector_index)
+        # Without the index rewrite the similarity query would return the farthest node, so it is not used
+        db._nearest_sql["hnsw"] = db._nearest_sql["hnsw"].replace("ORDER BY similarity", "ORDER BY similarity, id")
+        db._refresh_vector_index()
+        self.assertFalse(db._vector_index)
+        neighbors = db.nearest_nodes(vector=[1.0, 0.1, 0.0], limit=1)
+        self.assertEqual(neighbors[0].node.properties["name"], "node1")
+        db.conn.close()
+
+    def test_invalid_metric(self):
+        with self.assertRaises(ValueError):
+            GraphMemory(database=':memory:', vector_length=3, metric="manhattan")
+
+    def test_nearest_nodes_invalid_precision(self):
+        self.db.insert_node(Node(properties={"name": "node1"}, vector=[0.1, 0.2, 0.3]))
+        self.assertEqual(self.db.nearest_nodes(vector=[0.1, 0.2, 0.3], limit=1, precision="float16"), [])
+
+    def test_nearest_nodes_invalid_vector(self):
+        self.db.insert_node(Node(properties={"name": "node1"}, vector=[0.1, 0.2, 0.3]))
+        self.assertEqual(self.db.nearest_nodes(vector=[0.1, 0.2], limit=1), [])
+        self.assertEqual(self.db.nearest_nodes(vector=[0.1, "invalid", 0.3], limit=1), [])
+        self.assertEqual(len(self.db.nearest_nodes(vector=[0, 1, 0], limit=1)), 1)
+
+    def test_nearest_nodes_sequence_vector(self):
+        self.db.insert_node(Node(properties={"name": "node1"}, vector=[0.1, 0.2, 0.3]))
+        for vector in ((0.1, 0.2, 0.3), array.array('f', [0.1, 0.2, 0.3])):
+            neighbors = self.db.nearest_nodes(vector=vector, limit=1)
+            self.assertEqual(neighbors[0].node.properties["name"], "node1")
+        self.assertEqual(self.db.nearest_nodes(vector="abc", limit=1), [])
+
+    def test_nearest_nodes_set_vector_length(self):
+        db = GraphMemory(database=':memory:', vector_length=3)
+        db.set_vector_length(2)
+        db.conn.execute("DROP TABLE edges; DROP TABLE nodes;")
+        db._create_tables()
+        db.bulk_insert_nodes([Node(properties={"name": "node1"}, vector=[0.1, 0.2])])
+        neighbors = db.nearest_nodes(vector=[0.1, 0.2], limit=1)
+        self.assertEqual(neighbors[0].node.properties["name"], "node1")
+        self.assertIsNotNone(db.insert_node(Node(properties={"name": "node2"}, vector=[0.3, 0.4])))
+
     def test_nodes_to_json(self):
         node = Node(properties={"name": "node1"}, vector=[0.1, 0.2, 0.3])
         self.db.insert_node(node)
@@ -83,6 +264,14 @@ class TestGraphMemory(unittest.TestCase):
         self.assertAlmostEqual(nodes_json[0]['vector'][1], 0.2, places=7)
         self.assertAlmostEqual(nodes_json[0]['vector'][2], 0.3, places=7)
 
+    def test_nodes_by_attribute(self):
+        self.db.insert_node(Node(properties={"name": "node1", "age": 57, "address": {"city": "Boston"}}))
+        self.db.insert_node(Node(properties={"name": "node2", "age": "57"}))
+        self.assertEqual([n.properties["name"] for n in self.db.nodes_by_attribute("age", 57)], ["node1"])
+        self.assertEqual([n.properties["name"] for n in self.db.nodes_by_attribute("age", "57")], ["node2"])
+        self.assertEqual(len(self.db.nodes_by_attribute("address.city", "Boston")), 1)
+        self.assertEqual(self.db.nodes_by_attribute("name') = 1 OR ('1", "node1"), [])
+
     def test_edges_to_json(self):
         node1 = Node(properties={"name": "node1"}, vector=[0.1, 0.2, 0.3])
         node2 = Node(properties={"name": "node2"}, vector=[0.4, 0.5, 0.6])
@@ -97,6 +286,17 @@ class TestGraphMemory(unittest.TestCase):
         self.assertEqual(edges_json[0]['weight'], 0.5)
         self.assertEqual(edges_json[0]['relation'], "friendship")
 
+    def test_to_json_raw(self):
+        self.assertEqual(self.db.nodes_to_json(raw=True), "[]")
+        node1 = Node(properties={"name": "node1"}, vector=[0.1, 0.2, 0.3])
+        node2 = Node(type="Person", properties={"name": "node2"}, vector=[0.4, 0.5, 0.6])
+        self.db.bulk_insert_nodes([node1, node2])
+        self.db.insert_edge(Edge(source_id=node1.id, target_id=node2.id, weight=0.5, relation="friendship"))
+        nodes = json.loads(self.db.nodes_to_json(raw=True))
+        self.assertEqual(nodes, json.loads(json.dumps(self.db.nodes_to_json())))
+        self.assertIsNone(json.loads(self.db.nodes_to_json(include_vector=False, raw=True))[0]["vector"])
+        self.assertEqual(json.loads(self.db.edges_to_json(raw=True)), self.db.edges_to_json())
+
     def test_bulk_insert_nodes(self):
         nodes = [
             Node(properties={"name": "node1"}, vector=[0.1, 0.2, 0.3]),
@@ -106,6 +306,39 @@ class TestGraphMemory(unittest.TestCase):
         self.assertEqual(len(inserted_nodes), 2)
         self.assertTrue(all(node.id is not None for node in inserted_nodes))
 
+    def test_bulk_insert_nodes_iterable(self):
+        nodes = (Node(properties={"name": f"node{i}"}, vector=[0.1, 0.2, 0.3]) for i in range(3))
+        inserted_nodes = self.db.bulk_insert_nodes(nodes)
+        self.assertEqual(len(inserted_nodes), 3)
+        result = self.db.conn.execute("SELECT COUNT(*) FROM nodes").fetchone()
+        self.assertEqual(result[0], 3)
+        self.assertEqual(self.db.bulk_insert_nodes([]), [])
+
+    def test_bulk_insert_nodes_round_trip(self):
+        node1 = Node(type="Person", properties={"name": "node1", "tags": ["a", "b"]}, vector=[0.1, -0.2, 0.3])
+        node2 = Node(properties={"name": "node2"})
+        self.db.bulk_insert_nodes([node1, node2])
+        fetched = self.db.get_node(node1.id)
+        self.assertEqual(fetched.type, "Person")
+        self.assertEqual(fetched.properties, node1.properties)
+        self.assertEqual(len(fetched.vector), 3)
+        self.assertIsNone(self.db.get_node(node2.id).vector)
+        self.assertIsInstance(fetched.vector, list)
+        self.assertEqual(fetched.model_dump()["id"], node1.id)
+        self.assertEqual(self.db.bulk_insert_nodes([Node(vector=[0.1, 0.2])]), [])
+
+    def test_bulk_insert_nodes_defer_index(self):
+        self.db.create_index()
+        nodes = [
+            Node(properties={"name": "node1"}, vector=[0.1, 0.2, 0.3]),
+            Node(properties={"name": "node2"}, vector=[0.4, 0.5, 0.6])
+        ]
+        self.db.bulk_insert_nodes(nodes, defer_index=True)
+        result = self.db.conn.execute("SELECT COUNT(*) FROM duckdb_indexes() WHERE index_name = 'vss_idx'").fetchone()
+        self.assertEqual(result[0], 1)
+        neighbors = self.db.nearest_nodes(vector=[0.4, 0.5, 0.6], limit=1)
+        self.assertEqual(neighbors[0].node.properties["name"], "node2")
+
     def test_bulk_insert_edges(self):
         node1 = Node(properties={"name": "node1"}, vector=[0.1, 0.2, 0.3])
         node2 = Node(properties={"name": "node2"}, vector=[0.4, 0.5, 0.6])
@@ -119,6 +352,19 @@ class TestGraphMemory(unittest.TestCase):
         result = self.db.conn.execute("SELECT * FROM edges").fetchall()
         self.assertEqual(len(result), 2)
 
+    def test_bulk_insert_edges_missing_node(self):
+        node1 = Node(properties={"name": "node1"}, vector=[0.1, 0.2, 0.3])
+        node2 = Node(properties={"name": "node2"}, vector=[0.4, 0.5, 0.6])
+        self.db.bulk_insert_nodes([node1, node2])
+        self.db.bulk_insert_edges([])
+        edges = [
+            Edge(source_id=node1.id, target_id=node2.id, relation="friendship"),
+            Edge(source_id=node2.id, target_id=uuid.uuid4(), relation="colleague")
+        ]
+        self.db.bulk_insert_edges(edges)
+        result = self.db.conn.execute("SELECT COUNT(*) FROM edges").fetchone()
+        self.assertEqual(result[0], 0)
+
     def test_delete_node(self):
         node = Node(properties={"name": "node1"}, vector=[0.1, 0.2, 0.3])
         node_id = self.db.insert_node(node)
@@ -126,11 +372,28 @@ class TestGraphMemory(unittest.TestCase):
         result = self.db.conn.execute("SELECT * FROM nodes WHERE id = ?", (str(node_id),)).fetchone()
         self.assertIsNone(result)
 
+    def test_delete_node_with_edges(self):
+        node1_id = self.db.insert_node(Node(properties={"name": "node1"}, vector=[0.1, 0.2, 0.3]))
+        node2_id = self.db.insert_node(Node(properties={"name": "node2"}, vector=[0.4, 0.5, 0.6]))
+        self.db.insert_edge(Edge(source_id=node1_id, target_id=node2_id, relation="friendship"))
+        self.db.delete_node(node1_id)
+        self.assertIsNone(self.db.get_node(node1_id))
+        self.assertIsNotNone(self.db.get_node(node2_id))
+        self.assertEqual(self.db.edges_to_json(), [])
+
     def test_delete_non_existent_node(self):
         self.db.delete_node(uuid.uuid4())
         result = self.db.conn.execute("SELECT * FROM nodes WHERE id = ?", (uuid.uuid4(),)).fetchone()
         self.assertIsNone(result)
 
+    def test_get_node_prepared(self):
+        node_id = self.db.insert_node(Node(properties={"name": "node1"}, vector=[0.1, 0.2, 0.3]))
+        self.db.create_index()
+        self.assertEqual(self.db.get_node(node_id).properties["name"], "node1")
+        self.assertEqual(len(self.db.get_nodes_vector(node_id)), 3)
+        self.assertIsNone(self.db.get_node("1'; DROP TABLE nodes; --"))
+        self.assertIsNotNone(self.db.get_node(str(node_id)))
+
     def test_delete_edge(self):
         node1 = Node(properties={"name": "node1"}, vector=[0.1, 0.2, 0.3])
         node2 = Node(properties={"name": "node2"}, vector=[0.4, 0.5, 0.6])
@@ -157,6 +420,47 @@ class TestGraphMemory(unittest.TestCase):
         result = self.db.conn.execute("SELECT * FROM nodes WHERE properties = '{\"name\": \"node1\"}'").fetchone()
         self.assertIsNone(result)
 
+    def test_batch_aborted(self):
+        node = Node(properties={"name": "node1"}, vector=[0.1, 0.2, 0.3])
+        with self.assertRaises(duckdb.TransactionException):
+            with self.db.batch():
+                self.assertIsNotNone(self.db.insert_node(node))
+                # The duplicate key is logged and returns None, but aborts the transaction
+                self.assertIsNone(self.db.insert_node(node))
+                self.db.insert_node(Node(properties={"name": "node2"}, vector=[0.4, 0.5, 0.6]))
+        self.assertEqual(self.db.nodes_to_json(), [])
+        # The connection is usable again after the rollback
+        self.assertIsNotNone(self.db.insert_node(node))
+
+    def test_batch(self):
+        node1 = Node(properties={"name": "node1"}, vector=[0.1, 0.2, 0.3])
+        node2 = Node(properties={"name": "node2"}, vector=[0.4, 0.5, 0.6])
+        with self.db.batch():
+            self.db.insert_node(node1)
+            self.db.bulk_insert_nodes([node2])
+            self.db.insert_edge(Edge(source_id=node1.id, target_id=node2.id, relation="friendship"))
+        self.assertEqual(len(self.db.edges_to_json()), 1)
+        with self.assertRaises(RuntimeError):
+            with self.db.batch():
+                self.db.insert_node(Node(properties={"name": "node3"}, vector=[0.7, 0.8, 0.9]))
+                raise RuntimeError("Force rollback")
+        self.assertEqual(len(self.db.nodes_to_json()), 2)
+
+    def test_concurrent_reads(self):
+        node = Node(properties={"name": "node1"}, vector=[0.1, 0.2, 0.3])
+        self.db.insert_node(node)
+        with self.db.batch():
+            self.db.insert_node(Node(properties={"name": "node2"}, vector=[0.4, 0.5, 0.6]))
+            # Reads in the transaction see its writes
+            self.assertEqual(len(self.db.nodes_to_json()), 2)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.db.get_node(node.id))) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([result.properties for result in results], [{"name": "node1"}] * 4)
+
     def test_node_id(self):
         node1 = Node(properties={"name": "node1"}, vector=[0.1, 0.2, 0.3])
         node2 = Node(properties={"name": "node2"}, vector=[0.4, 0.5, 0.6])
@@ -166,6 +470,17 @@ class TestGraphMemory(unittest.TestCase):
         self.assertIsInstance(id1, uuid.UUID)
         self.assertIsInstance(id2, uuid.UUID)
 
+    def test_insert_node_current_properties(self):
+        node = Node(properties={"name": "alice"}, vector=[0.1, 0.2, 0.3])
+        self.db.insert_node(node)
+        copy = node.model_copy(update={"id": uuid.uuid4(), "properties": {"name": "bob"}})
+        self.db.insert_node(copy)
+        self.assertEqual(self.db.get_node(copy.id).properties, {"name": "bob"})
+        node.properties["name"] = "carol"
+        node.id = uuid.uuid4()
+        self.db.insert_node(node)
+        self.assertEqual(self.db.get_node(node.id).properties, {"name": "carol"})
+
     def test_edge_id(self):
         node1 = Node(properties={"name": "node1"}, vector=[0.1, 0.2, 0.3])
         node2 = Node(properties={"name": "node2"}, vector=[0.4, 0.5, 0.6])
@@ -233,6 +548,26 @@ class TestGraphMemoryGetConnectedNodes(unittest.TestCase):
         self.assertEqual(len(connected_nodes), 1)
         self.assertEqual(connected_nodes[0].id, self.node2_id)
 
+        # String ids are accepted as well as uuid.UUID
+        self.assertEqual([node.id for node in self.db.connected_nodes(str(self.node3_id))], [self.node2_id])
+
+    def test_connected_nodes_include_vector(self):
+        self.assertIsNone(self.db.connected_nodes(self.node1_id)[0].vector)
+        connected_nodes = self.db.connected_nodes(self.node1_id, include_vector=True)
+        self.assertAlmostEqual(connected_nodes[0].vector[0], 0.4, places=6)
+        self.assertIsNone(self.db.get_node(self.node1_id, include_vector=False).vector)
+        self.assertEqual(len(self.db.get_node(self.node1_id).vector), 3)
+        self.assertIsNone(self.db.nodes_to_json(include_vector=False)[0]["vector"])
+        self.assertIsNone(self.db.nodes_by_attribute("name", "node2")[0].vector)
+
+    def test_connected_nodes_deduplicated(self):
+        # node3 is linked to node2 in both directions but should be returned once
+        self.db.insert_edge(Edge(source_id=self.node3_id, target_id=self.node2_id, relation="colleague"))
+        connected_nodes = self.db.connected_nodes(self.node3_id)
+        self.assertEqual([node.id for node in connected_nodes], [self.node2_id])
+        indexes = self.db.conn.execute("SELECT index_name FROM duckdb_indexes() WHERE table_name = 'edges'").fetchall()
+        self.assertEqual(sorted(row[0] for row in indexes), ["edges_source_idx", "edges_target_idx"])
+
     def tearDown(self):
         self.db.conn.close()
 
@@ -265,14 +600,33 @@ class TestCypherToSQL(unittest.TestCase):
         expected_sql_query = (
             "SELECT * "
             "FROM nodes AS n "
-            "WHERE n.type = 'Person' "
-            "AND json_extract(n.properties, '$.name') = json('\"George Washington\"') "
-            "AND json_extract(n.properties, '$.age') = json('57');"
+            "WHERE n.type = $1 "
+            "AND json_extract(n.properties, $2) = json($3) "
+            "AND json_extract(n.properties, $4) = json($5);"
         )
 
-        sql_query = self.graph._cypher_to_sql(cypher_query)
+        sql_query, params = self.graph._cypher_to_sql(cypher_query)
         logger.info(f"Generated SQL Query: {sql_query}")
         self.assertEqual(sql_query.strip(), expected_sql_query.strip())
+        self.assertEqual(params, ["Person", "$.name", '"George Washington"', "$.age", "57"])
+
+    def test_cypher_values_are_parameters(self):
+        # Queries that only differ in their values share the same SQL
+        sql_query, params = self.graph._cypher_to_sql("MATCH (n:Person {name: \"x') OR 1=1 --\"}) RETURN n")
+        other_sql_query, _ = self.graph._cypher_to_sql("MATCH (n:Person {name: 'Thomas Jefferson'}) RETURN n")
+        self.assertEqual(sql_query, other_sql_query)
+        self.assertEqual(self.graph.cypher("MATCH (n:Person {name: \"x') OR 1=1 --\"}) RETURN n"), [])
+
+    def test_cypher_parser(self):
+        sql_query, params = self.graph._cypher_to_sql(
+            "match (a:Person {name: 'George Washington'})-[r:KNOWS {since: 1790}]->(b) return a.embedding, b")
+        self.assertIn("JOIN nodes AS b ON a.id = r.start_node_id AND b.id = r.end_node_id", sql_query)
+        self.assertEqual(params, ["Person", "$.name", '"George Washington"', "KNOWS", "$.since", "1790"])
+        _, params = self.graph._cypher_to_sql("MATCH (n {zip: '02139', floor: 2.5, city: \"' x '\"}) RETURN n")
+        self.assertEqual(params, ["$.zip", '"02139"', "$.floor", "2.5", "$.city", '"\' x \'"'])
+        for query in ("MATCH (n:Person) n", "MATCH (n:Person {name 'x'}) RETURN n", "MATCH (n) RETURN n LIMIT 1"):
+            with self.assertRaises(ValueError):
+                self.graph._cypher_to_sql(query)
 
     def test_cypher_method(self):
         # Use the cypher method to query the node